@@ -1,22 +1,37 @@
 # Standard library imports
+import asyncio
+import hashlib
+import logging
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Tuple
 import uvicorn
 # Third-party imports
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
+from cachetools import TLRUCache
 import firebase_admin
 from firebase_admin import credentials, firestore, db
 from dotenv import load_dotenv
 
 # Pydantic Models
 class EventData(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True, from_attributes=False)
+
     movie_id: int
 
 class InteractionEvent(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True, from_attributes=False)
+
     user_id: str
     event_type: str
     event_data: EventData
@@ -25,10 +40,38 @@ class InteractionEvent(BaseModel):
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Constants
 TMDB_BASE_URL = "https://api.themoviedb.org/3"
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
+TMDB_TRENDING_PATH = "/trending/movie/week"
 CACHE_DURATION = 86400  # 1 day in seconds
+CLIENT_CACHE_MAX_AGE = 3600  # seconds clients and CDNs may reuse a response
+
+# Movie fields returned to clients; everything else from TMDB is dropped before caching
+MOVIE_FIELDS = ("id", "title", "poster_path", "release_date", "vote_average")
+
+# In-process cache in front of the Firebase cache, keyed by TMDB endpoint.
+# Values are (data, refreshed_at) pairs and expire CACHE_DURATION after refreshed_at.
+def _tmdb_cache_expiry(_key: str, value: Tuple[Any, float], now: float) -> float:
+    return now + CACHE_DURATION - (time.time() - value[1])
+
+_tmdb_cache = TLRUCache(maxsize=1024, ttu=_tmdb_cache_expiry)
+# Per-key locks so only one coroutine refreshes a given entry on a miss.
+# Each entry is [lock, users] and is removed once no coroutine holds or awaits it.
+_tmdb_locks: Dict[str, list] = {}
+
+# Client-side TMDB throttle to stay under the CDN's per-IP limits
+TMDB_RATE_LIMIT = 40  # requests
+TMDB_RATE_PERIOD = 10  # seconds
+
+# Interaction batching
+INTERACTION_BATCH_SIZE = 100
+INTERACTION_FLUSH_INTERVAL = 0.5  # seconds
+INTERACTION_QUEUE_MAXSIZE = 10000
+INTERACTION_FLUSH_RETRIES = 3
+INTERACTION_RETRY_BACKOFF = 0.5  # seconds, doubled after each failed attempt
 
 # Firebase Configuration
 FIREBASE_DB_URL = 'https://movie-recommender-f0ad3-default-rtdb.firebaseio.com'
@@ -37,11 +80,48 @@ FIREBASE_DB_URL = 'https://movie-recommender-f0ad3-default-rtdb.firebaseio.com'
 if not TMDB_API_KEY:
     raise ValueError("TMDB_API_KEY not found in environment variables. Make sure it's set in your .env file.")
 
+# Default headers sent with every TMDB request
+TMDB_HEADERS = {
+    "Authorization": f"Bearer {TMDB_API_KEY}",
+    "accept": "application/json"
+}
+
+# Application lifespan
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A preset firebase_reference (e.g. an in-memory fake in tests) skips SDK initialization
+    if not hasattr(app.state, "firebase_reference"):
+        await asyncio.to_thread(init_firebase)
+        app.state.firebase_reference = db.reference
+    # Shared TMDB client so connections are pooled across requests
+    app.state.http_client = httpx.AsyncClient(
+        base_url=TMDB_BASE_URL,
+        headers=TMDB_HEADERS,
+        timeout=httpx.Timeout(5.0),
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    )
+    # Created here so the limiter and queue belong to the loop running this app
+    app.state.tmdb_limiter = AsyncLimiter(max_rate=TMDB_RATE_LIMIT, time_period=TMDB_RATE_PERIOD)
+    app.state.interaction_queue = asyncio.Queue(maxsize=INTERACTION_QUEUE_MAXSIZE)
+    flush_task = asyncio.create_task(
+        _flush_interactions_loop(app.state.interaction_queue, app.state.firebase_reference)
+    )
+    yield
+    # The flush loop writes out its current batch and the rest of the queue when cancelled
+    flush_task.cancel()
+    try:
+        await flush_task
+    except asyncio.CancelledError:
+        pass
+    await app.state.http_client.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Movie Recommender API",
     description="Backend API for the Movie Recommender application",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS Configuration
@@ -60,120 +140,303 @@ app.add_middleware(
 
 # Initialize Firebase
 def init_firebase():
+    # Only one Firebase app may be registered per process
+    try:
+        firebase_admin.get_app()
+        return
+    except ValueError:
+        pass
     try:
         cred = credentials.Certificate("serviceAccountKey.json")
         firebase_admin.initialize_app(cred, {
             'databaseURL': FIREBASE_DB_URL
         })
-        # Test connection
-        ref = db.reference('/')
-        data = ref.get()
-        print(f"Successfully connected to Firebase RTDB!")
-    except Exception as e:
-        print(f"Error initializing Firebase: {e}")
+        logger.info("Firebase app initialized")
+    except Exception:
+        logger.exception("Error initializing Firebase")
         raise
 
+# Interaction Batching
+def _drain_interaction_queue(queue: asyncio.Queue) -> Dict[str, Dict]:
+    """
+    Pop every queued interaction without waiting
+    """
+    batch = {}
+    while not queue.empty():
+        interaction_id, interaction_data = queue.get_nowait()
+        batch[interaction_id] = interaction_data
+    return batch
+
+async def _flush_interactions(batch: Dict[str, Dict], reference: Callable[[str], Any]):
+    """
+    Write a batch of interactions to Firebase in a single update, retrying with backoff
+    """
+    if not batch:
+        return
+    delay = INTERACTION_RETRY_BACKOFF
+    for attempt in range(1, INTERACTION_FLUSH_RETRIES + 1):
+        try:
+            await asyncio.to_thread(reference('interactions').update, batch)
+            return
+        except Exception:
+            if attempt == INTERACTION_FLUSH_RETRIES:
+                logger.exception("Dropping %d interactions after %d failed writes, ids: %s",
+                                 len(batch), attempt, ", ".join(batch))
+                return
+            logger.warning("Error flushing %d interactions (attempt %d), retrying in %.1fs",
+                           len(batch), attempt, delay, exc_info=True)
+            await asyncio.sleep(delay)
+            delay *= 2
+
+async def _flush_interactions_loop(queue: asyncio.Queue, reference: Callable[[str], Any]):
+    """
+    Collect queued interactions and flush them in batches
+    """
+    loop = asyncio.get_running_loop()
+    batch: Dict[str, Dict] = {}
+    try:
+        while True:
+            interaction_id, interaction_data = await queue.get()
+            batch[interaction_id] = interaction_data
+            deadline = loop.time() + INTERACTION_FLUSH_INTERVAL
+            while len(batch) < INTERACTION_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    interaction_id, interaction_data = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch[interaction_id] = interaction_data
+            await _flush_interactions(batch, reference)
+            batch = {}
+    except asyncio.CancelledError:
+        # Shutting down: write the collected batch and anything still queued.
+        # Updates are keyed by interaction id, so re-writing a batch is harmless.
+        batch.update(_drain_interaction_queue(queue))
+        await _flush_interactions(batch, reference)
+        raise
+
+# Dependencies
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """
+    Return the shared TMDB client created in the lifespan handler
+    """
+    return request.app.state.http_client
+
+def get_firebase_reference(request: Request) -> Callable[[str], Any]:
+    """
+    Return the Firebase RTDB reference factory chosen in the lifespan handler
+    """
+    return request.app.state.firebase_reference
+
+def get_interaction_queue(request: Request) -> asyncio.Queue:
+    """
+    Return the interaction queue created in the lifespan handler
+    """
+    return request.app.state.interaction_queue
+
 # TMDB API Functions
-def fetch_trending_movies() -> List[Dict]:
+async def fetch_trending_movies(
+    client: httpx.AsyncClient, etag: Optional[str] = None
+) -> Tuple[Optional[List[Dict]], Optional[str]]:
     """
     Fetch trending movies from TMDB API
+
+    Returns the movies and the response ETag. Movies are None when TMDB
+    answers 304 Not Modified for the given etag.
     """
-    url = f"{TMDB_BASE_URL}/trending/movie/week"
-    headers = {
-        "Authorization": f"Bearer {TMDB_API_KEY}",
-        "accept": "application/json"
-    }
+    headers = {"If-None-Match": etag} if etag else None
     try:
-        response = requests.get(url, headers=headers)
+        async with app.state.tmdb_limiter:
+            response = await client.get(TMDB_TRENDING_PATH, headers=headers)
+        if response.status_code == 304:
+            return None, etag
         response.raise_for_status()
-        data = response.json()
-        return data.get("results", [])
-    except requests.RequestException as e:
+        data = orjson.loads(response.content)
+        return data.get("results", []), response.headers.get("etag")
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
         raise HTTPException(status_code=500, detail=f"Error fetching TMDB data: {str(e)}")
 
-async def get_cached_trending_movies() -> List[Dict]:
+def project_movies(movies: List[Dict]) -> List[Dict]:
+    """
+    Keep only the movie fields clients consume
+    """
+    return [{field: movie.get(field) for field in MOVIE_FIELDS} for movie in movies]
+
+async def cached_tmdb(
+    key: str, fetcher: Callable[[], Awaitable[Tuple[Any, float]]]
+) -> Tuple[Any, float]:
+    """
+    Return the cached (data, refreshed_at) pair for key, calling fetcher on a miss
+    """
+    cached = _tmdb_cache.get(key)
+    if cached is not None:
+        return cached
+
+    entry = _tmdb_locks.get(key)
+    if entry is None:
+        entry = _tmdb_locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            # Another coroutine may have refreshed the entry while we waited
+            cached = _tmdb_cache.get(key)
+            if cached is not None:
+                return cached
+            value = await fetcher()
+            _tmdb_cache[key] = value
+            return value
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _tmdb_locks[key]
+
+def content_etag(payload: Any) -> str:
+    """
+    Build a strong ETag from the serialized payload
+    """
+    return '"%s"' % hashlib.blake2b(orjson.dumps(payload), digest_size=16).hexdigest()
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against etag (RFC 9110)
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+async def load_trending_movies(
+    client: httpx.AsyncClient, reference: Callable[[str], Any]
+) -> Tuple[Tuple[List[Dict], str], float]:
+    """
+    Load trending movies from the Firebase cache, refreshing from TMDB when stale
+
+    Returns the movies with their content ETag, and the epoch time they were last refreshed.
+    """
+    cache_ref = reference("cache/trending_movies")
+    # The cache is stored as a single serialized blob to avoid per-field RTDB work
+    raw = await asyncio.to_thread(cache_ref.child("blob").get)
+
+    cache_doc = orjson.loads(raw) if raw else None
+    if cache_doc and time.time() - cache_doc["ts"] < CACHE_DURATION:
+        movies = project_movies(cache_doc["movies"])
+        return (movies, content_etag(movies)), cache_doc["ts"]
+
+    # Revalidate a stale cache with its ETag so unchanged lists skip the download
+    etag = cache_doc.get("etag") if cache_doc else None
+    movies, etag = await fetch_trending_movies(client, etag)
+    if movies is None:
+        movies = cache_doc["movies"]
+    # Projected on both the 200 and 304 paths so older unprojected blobs get trimmed too
+    movies = project_movies(movies)
+    timestamp = time.time()
+    blob = orjson.dumps({"movies": movies, "etag": etag, "ts": timestamp}).decode()
+    await asyncio.to_thread(cache_ref.set, {"blob": blob})
+    return (movies, content_etag(movies)), timestamp
+
+async def get_cached_trending_movies(
+    client: httpx.AsyncClient, reference: Callable[[str], Any]
+) -> Tuple[List[Dict], str]:
     """
     Get trending movies with caching
+
+    Returns the movies and their content ETag.
     """
-    cache_ref = db.reference("cache/trending_movies")
-    # Fetch cache document
-    cache_doc = cache_ref.get()
-
-    if cache_doc:
-        cached_time = cache_doc.get("timestamp")
-        if cached_time:
-            # Convert string timestamp back to datetime for comparison
-            cached_datetime = datetime.fromisoformat(cached_time)
-            if (datetime.now() - cached_datetime).total_seconds() < CACHE_DURATION:
-                return cache_doc.get("movies", [])
-
-    movies = fetch_trending_movies()
-    cache_ref.set({
-        "movies": movies,
-        "timestamp": datetime.now().isoformat()  # Convert datetime to ISO format string
-    })
-    return movies
+    (movies, etag), _ = await cached_tmdb("trending/week", partial(load_trending_movies, client, reference))
+    return movies, etag
 
 # API Routes
-@app.get("/")
+status_router = APIRouter(tags=["status"])
+movies_router = APIRouter(tags=["movies"])
+interactions_router = APIRouter(tags=["interactions"])
+
+@status_router.get("/")
 def read_root():
     """
     Root endpoint
     """
     return {"status": "active", "message": "Movie Recommender API is running"}
 
-@app.get("/health")
+@status_router.get("/health")
 def health_check():
     """
     Health check endpoint
     """
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
-@app.get("/trending-movies", response_model=List[Dict])
-async def get_trending_movies():
+@movies_router.get("/trending-movies")
+async def get_trending_movies(
+    request: Request,
+    client: httpx.AsyncClient = Depends(get_http_client),
+    reference: Callable[[str], Any] = Depends(get_firebase_reference)
+) -> Response:
     """
     Get trending movies endpoint
     """
-    return await get_cached_trending_movies()
+    movies, etag = await get_cached_trending_movies(client, reference)
+    headers = {
+        "Cache-Control": f"public, max-age={CLIENT_CACHE_MAX_AGE}",
+        "ETag": etag
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    # Returning the response directly skips FastAPI's jsonable_encoder pass
+    return ORJSONResponse(content=movies, headers=headers)
 
-@app.post("/track")
-async def track_interaction(event: InteractionEvent):
+@interactions_router.post("/track")
+async def track_interaction(
+    event: InteractionEvent, queue: asyncio.Queue = Depends(get_interaction_queue)
+):
     """
     Track user interaction with movies
     """
+    # Create a new interaction document
+    interaction_data = {
+        "user_id": event.user_id,
+        "event_type": event.event_type,
+        "event_data": {"movie_id": event.event_data.movie_id},
+        "timestamp": event.timestamp,
+        "created_at": datetime.now().isoformat()  # Server timestamp
+    }
+    
+    # Queue the data for the next batched write to Firebase
+    interaction_id = uuid.uuid4().hex
     try:
-        print(f"Tracking interaction: {event}")
-        # Get reference to interactions collection
-        interactions_ref = db.reference('interactions')
-        
-        # Create a new interaction document
-        interaction_data = {
-            "user_id": event.user_id,
-            "event_type": event.event_type,
-            "event_data": event.event_data.dict(),
-            "timestamp": event.timestamp,
-            "created_at": datetime.now().isoformat()  # Server timestamp
-        }
-        
-        # Push the data to Firebase (this creates a unique key)
-        new_interaction = interactions_ref.push(interaction_data)
-        
-        return {
-            "status": "success",
-            "message": "Interaction tracked successfully",
-            "interaction_id": new_interaction.key
-        }
-    except Exception as e:
+        queue.put_nowait((interaction_id, interaction_data))
+        logger.debug("Queued %s interaction %s", event.event_type, interaction_id)
+    except asyncio.QueueFull:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error tracking interaction: {str(e)}"
+            status_code=503,
+            detail="Interaction queue is full, please retry later"
         )
+    
+    return {
+        "status": "queued",
+        "message": "Interaction queued for tracking",
+        "interaction_id": interaction_id
+    }
 
-
-# Initialize Firebase on startup
-init_firebase()
-     
+app.include_router(status_router)
+app.include_router(movies_router)
+app.include_router(interactions_router)
 
 if __name__ == "__main__":
-    
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Workers need an import string so each process can load the app itself
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=os.cpu_count(),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning"
+    )
@@ -0,0 +1,4 @@
+import os
+
+# app.py refuses to import without a TMDB key; tests never reach the real API
+os.environ.setdefault("TMDB_API_KEY", "test-key")
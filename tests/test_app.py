@@ -0,0 +1,201 @@
+import asyncio
+import time
+
+import httpx
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+from app import TMDB_BASE_URL, app, etag_matches, get_http_client
+
+TMDB_RESULTS = [
+    {
+        "id": 1,
+        "title": "Movie One",
+        "poster_path": "/one.jpg",
+        "release_date": "2024-01-01",
+        "vote_average": 7.5,
+        "overview": "Long overview",
+        "genre_ids": [28],
+        "adult": False,
+    },
+    {
+        "id": 2,
+        "title": "Movie Two",
+        "poster_path": "/two.jpg",
+        "vote_average": 6.0,
+        "backdrop_path": "/two-backdrop.jpg",
+    },
+]
+
+PROJECTED = [
+    {"id": 1, "title": "Movie One", "poster_path": "/one.jpg", "release_date": "2024-01-01", "vote_average": 7.5},
+    {"id": 2, "title": "Movie Two", "poster_path": "/two.jpg", "release_date": None, "vote_average": 6.0},
+]
+
+
+class FakeReference:
+    """
+    Minimal in-memory stand-in for a firebase_admin RTDB reference
+    """
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+
+    def child(self, name):
+        return FakeReference(self._store, f"{self._path}/{name}")
+
+    def get(self):
+        return self._store.get(self._path)
+
+    def set(self, value):
+        self.update(value)
+
+    def update(self, value):
+        for key, child in value.items():
+            self._store[f"{self._path}/{key}"] = child
+
+
+@pytest.fixture
+def store():
+    return {}
+
+
+@pytest.fixture
+def make_client(store):
+    app_module._tmdb_cache.clear()
+    app.state.firebase_reference = lambda path: FakeReference(store, path)
+
+    def factory(handler):
+        tmdb = httpx.AsyncClient(base_url=TMDB_BASE_URL, transport=httpx.MockTransport(handler))
+        app.dependency_overrides[get_http_client] = lambda: tmdb
+        return TestClient(app)
+
+    yield factory
+    app.dependency_overrides.clear()
+    del app.state.firebase_reference
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", W/"abc"', True),
+    ("*", True),
+    ('"x"', False),
+    ("", False),
+    (None, False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+def test_trending_movies_fetches_projects_and_caches(make_client, store):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"results": TMDB_RESULTS}, headers={"ETag": '"tmdb-1"'})
+
+    with make_client(handler) as client:
+        first = client.get("/trending-movies")
+        second = client.get("/trending-movies")
+
+    assert first.status_code == 200
+    assert first.json() == PROJECTED
+    assert first.headers["cache-control"] == "public, max-age=3600"
+    assert second.headers["etag"] == first.headers["etag"]
+    # The second request is served from the in-process cache
+    assert len(requests) == 1
+    assert "if-none-match" not in requests[0].headers
+
+    cached = orjson.loads(store["cache/trending_movies/blob"])
+    assert cached["movies"] == PROJECTED
+    assert cached["etag"] == '"tmdb-1"'
+
+
+def test_trending_movies_revalidates_stale_cache_with_tmdb_etag(make_client, store):
+    # Stale blob written before projection existed, still holding full TMDB objects
+    store["cache/trending_movies/blob"] = orjson.dumps(
+        {"movies": TMDB_RESULTS, "etag": '"tmdb-1"', "ts": 0}
+    ).decode()
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(304)
+
+    with make_client(handler) as client:
+        response = client.get("/trending-movies")
+
+    assert response.status_code == 200
+    assert response.json() == PROJECTED
+    assert requests[0].headers["if-none-match"] == '"tmdb-1"'
+
+    cached = orjson.loads(store["cache/trending_movies/blob"])
+    assert cached["movies"] == PROJECTED
+    assert cached["etag"] == '"tmdb-1"'
+    assert time.time() - cached["ts"] < 60
+
+
+def test_trending_movies_answers_matching_if_none_match_with_304(make_client):
+    def handler(request):
+        return httpx.Response(200, json={"results": TMDB_RESULTS})
+
+    with make_client(handler) as client:
+        etag = client.get("/trending-movies").headers["etag"]
+        response = client.get("/trending-movies", headers={"If-None-Match": f"W/{etag}"})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_trending_movies_reports_malformed_tmdb_json(make_client):
+    def handler(request):
+        return httpx.Response(200, content=b"<html>oops</html>")
+
+    with make_client(handler) as client:
+        response = client.get("/trending-movies")
+
+    assert response.status_code == 500
+    assert response.json()["detail"].startswith("Error fetching TMDB data")
+
+
+def test_track_flushes_queued_interactions_on_shutdown(make_client, store):
+    def handler(request):
+        raise AssertionError("TMDB should not be called")
+
+    with make_client(handler) as client:
+        ids = []
+        for movie_id in range(3):
+            response = client.post("/track", json={
+                "user_id": "user-1",
+                "event_type": "click",
+                "event_data": {"movie_id": movie_id},
+                "timestamp": "2024-01-01T00:00:00",
+            })
+            assert response.json()["status"] == "queued"
+            ids.append(response.json()["interaction_id"])
+
+    written = {key.rsplit("/", 1)[1]: value for key, value in store.items() if key.startswith("interactions/")}
+    assert sorted(written) == sorted(ids)
+    assert {value["event_data"]["movie_id"] for value in written.values()} == {0, 1, 2}
+
+
+def test_cached_tmdb_fetches_once_per_key():
+    app_module._tmdb_cache.clear()
+    calls = []
+
+    async def fetcher():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value", time.time()
+
+    async def main():
+        return await asyncio.gather(*[app_module.cached_tmdb("single-flight", fetcher) for _ in range(10)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert {value for value, _ in results} == {"value"}
+    assert "single-flight" not in app_module._tmdb_locks